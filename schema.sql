@@ -19,11 +19,11 @@ CREATE TABLE IF NOT EXISTS fx_rates (
 -- Index for fast lookups by date
 CREATE INDEX IF NOT EXISTS idx_fx_rates_date ON fx_rates(rate_date);
 
--- Index for fast lookups by currency
-CREATE INDEX IF NOT EXISTS idx_fx_rates_currency ON fx_rates(currency);
-
--- Index for combined queries
-CREATE INDEX IF NOT EXISTS idx_fx_rates_currency_date ON fx_rates(currency, rate_date);
+-- Index for currency history queries: matches WHERE currency = ?
+-- ORDER BY rate_date DESC, so rows come out of the index already in
+-- result order (no sort step, and LIMIT stops the scan early).
+-- Also covers plain lookups by currency via its leading column.
+CREATE INDEX IF NOT EXISTS idx_fx_rates_currency_date ON fx_rates(currency, rate_date DESC);
 
 -- Index for fetched_at timestamp queries
 CREATE INDEX IF NOT EXISTS idx_fx_rates_fetched ON fx_rates(fetched_at);
@@ -3,37 +3,76 @@ BNR FX Rates Pipeline - Cloudflare Worker (Python)
 Fetches Romanian National Bank exchange rates and serves via API
 """
 
-from workers import handler, Request, Response
+try:
+    from workers import handler, Request, Response
+except ImportError:  # running outside the Workers runtime (local tests)
+    def handler(func):
+        return func
+
+    class Request:
+        pass
+
+    class Response:
+        def __init__(self, body, status=200, headers=None):
+            self.body = body
+            self.status = status
+            self.headers = headers or {}
+
 import json
+import sys
 from datetime import datetime
+from io import StringIO
+from urllib.parse import urlsplit, parse_qs
+from xml.etree.ElementTree import iterparse, ParseError
 
-# XML parsing helper (manual parsing since we're in Workers environment)
+# XML parsing helper (incremental parsing since we're in Workers environment)
 def parse_bnr_xml(xml_text: str) -> dict:
     """
     Parse BNR XML format and extract rates.
-    Returns: {"date": "YYYY-MM-DD", "rates": [{"currency": "EUR", "value": 4.9770, "multiplier": 1}, ...]}
+    Returns: {"date": "YYYY-MM-DD", "rates": [("EUR", 4.9770, 1), ...]}
+    where each rate is a (currency, value, multiplier) tuple.
     """
-    rates = []
+    # One cheap C-level substring count lets us allocate the list once
+    # instead of growing it append-by-append. The count is only a hint:
+    # an overcount (e.g. "<Rate" inside text) is trimmed after the scan,
+    # and an undercount (prefixed tags like <d:Rate> don't contain a
+    # literal "<Rate") falls back to append below.
+    rates = [None] * xml_text.count("<Rate")
+    n = 0
     date_str = None
 
-    # Extract date from <Cube date="YYYY-MM-DD">
-    import re
-    date_match = re.search(r'<Cube date="(\d{4}-\d{2}-\d{2})"', xml_text)
-    if date_match:
-        date_str = date_match.group(1)
-
-    # Extract rates from <Rate currency="XXX" multiplier="N">value</Rate>
-    rate_pattern = re.compile(r'<Rate currency="([A-Z]{3})"(?:\s+multiplier="(\d+)")?>([0-9.]+)</Rate>')
-    for match in rate_pattern.finditer(xml_text):
-        currency = match.group(1)
-        multiplier = int(match.group(2)) if match.group(2) else 1
-        value = float(match.group(3))
-        rates.append({
-            "currency": currency,
-            "value": value,
-            "multiplier": multiplier
-        })
-
+    # iterparse drives expat incrementally (C speed) and lets us free
+    # each <Rate> element as soon as it is consumed, so memory stays
+    # flat instead of holding the whole document tree. Tags arrive
+    # namespaced ({http://www.bnr.ro/xsd}Rate), so match on the local
+    # name only.
+    try:
+        for _, elem in iterparse(StringIO(xml_text)):
+            tag = elem.tag.rpartition("}")[2]
+            if tag == "Rate":
+                currency = elem.get("currency")
+                if currency is None:
+                    continue
+                try:
+                    value = float(elem.text)
+                    multiplier = int(elem.get("multiplier", 1))
+                except (TypeError, ValueError):
+                    continue
+                # Tuples are lighter than dicts: one flat allocation,
+                # no per-row hashing of the same three key strings
+                if n < len(rates):
+                    rates[n] = (currency, value, multiplier)
+                else:
+                    rates.append((currency, value, multiplier))
+                n += 1
+                elem.clear()
+            elif tag == "Cube" and date_str is None:
+                date_str = elem.get("date")
+    except ParseError:
+        # Not well-formed XML; return whatever was parsed before the error
+        pass
+
+    del rates[n:]
     return {"date": date_str, "rates": rates}
 
 
@@ -48,32 +87,133 @@ async def fetch_bnr_rates() -> dict:
     return parse_bnr_xml(xml_text)
 
 
+# Currency codes BNR actually publishes; anything else in the feed is
+# noise we don't want to write to the database.
+_BNR_CURRENCIES = frozenset([
+    "AED", "AUD", "BGN", "BRL", "CAD", "CHF", "CNY", "CZK", "DKK", "EGP",
+    "EUR", "GBP", "HKD", "HUF", "IDR", "ILS", "INR", "ISK", "JPY", "KRW",
+    "MDL", "MXN", "MYR", "NOK", "NZD", "PHP", "PLN", "RSD", "RUB", "SEK",
+    "SGD", "THB", "TRY", "UAH", "USD", "XAU", "XDR", "ZAR",
+])
+
+# Last row written per currency, so re-runs of the cron (or BNR serving
+# the same day twice) skip the DB write entirely for unchanged rates.
+_last_upserted = {}
+
+# One placeholder group per rate row in the batched upsert
+_UPSERT_ROW = "(?, ?, ?, ?, datetime('now'), datetime('now'), datetime('now'))"
+
+# D1 caps bound parameters at 100 per statement; 20 rows x 4 params stays under it
+_UPSERT_CHUNK_SIZE = 20
+
+_UPSERT_SQL = """
+    INSERT INTO fx_rates (rate_date, currency, value, multiplier, fetched_at, created_at, updated_at)
+    VALUES {}
+    ON CONFLICT(rate_date, currency) DO UPDATE SET
+        value = excluded.value,
+        multiplier = excluded.multiplier,
+        fetched_at = datetime('now'),
+        updated_at = datetime('now')
+"""
+
+# Prepared statements keyed by (db binding, SQL text). Re-preparing
+# the same SQL on every call is wasted parse work; .bind() returns a
+# fresh bound statement and leaves the cached one reusable. Keying by
+# id(db) keeps a statement from being replayed against a binding that
+# didn't prepare it (env.DB is stable for the life of an isolate, but
+# tests and multi-binding setups pass different handles). The db
+# object itself is held in the key tuple, so its id can't be recycled
+# while the entry lives.
+_stmt_cache = {}
+
+
+def _prepare_cached(db, sql: str):
+    key = (id(db), sql)
+    entry = _stmt_cache.get(key)
+    if entry is None:
+        entry = _stmt_cache[key] = (db, db.prepare(sql))
+    return entry[1]
+
+
+def _upsert_stmt(db, n_rows: int):
+    return _prepare_cached(db, _UPSERT_SQL.format(",".join([_UPSERT_ROW] * n_rows)))
+
+
 async def upsert_rates(env, date_str: str, rates: list):
     """Insert or update rates in D1 database."""
     db = env.DB
 
-    for rate in rates:
-        await db.prepare("""
-            INSERT INTO fx_rates (rate_date, currency, value, multiplier, fetched_at, created_at, updated_at)
-            VALUES (?, ?, ?, ?, datetime('now'), datetime('now'), datetime('now'))
-            ON CONFLICT(rate_date, currency) DO UPDATE SET
-                value = excluded.value,
-                multiplier = excluded.multiplier,
-                fetched_at = datetime('now'),
-                updated_at = datetime('now')
-        """).bind(date_str, rate["currency"], rate["value"], rate["multiplier"]).run()
+    # Intern the codes (they recur every day, so comparisons become
+    # pointer checks), drop anything outside the BNR allowlist, and
+    # skip rows identical to what we last wrote.
+    pending = []
+    for currency, value, multiplier in rates:
+        currency = sys.intern(currency)
+        if currency not in _BNR_CURRENCIES:
+            continue
+        if _last_upserted.get(currency) == (date_str, value, multiplier):
+            continue
+        pending.append((currency, value, multiplier))
+
+    # Batch all rows into multi-VALUES statements so we pay one D1
+    # round-trip per chunk instead of one per currency, then send the
+    # chunks through db.batch so the whole upsert is a single
+    # transactional round-trip.
+    stmts = []
+    for i in range(0, len(pending), _UPSERT_CHUNK_SIZE):
+        chunk = pending[i:i + _UPSERT_CHUNK_SIZE]
+
+        params = []
+        for currency, value, multiplier in chunk:
+            params.extend([date_str, currency, value, multiplier])
+
+        stmts.append(_upsert_stmt(db, len(chunk)).bind(*params))
+
+    if stmts:
+        await db.batch(stmts)
+        # Only record rows after the batch lands, so a failed write
+        # doesn't poison the skip cache
+        for currency, value, multiplier in pending:
+            _last_upserted[currency] = (date_str, value, multiplier)
+        # New rows may change what "latest" means
+        _latest_cache["date"] = None
+        _latest_cache["rows"] = None
+
+
+# Read-path SQL, hoisted so the statements can be prepared once per
+# binding instead of re-parsed on every HTTP request.
+_RATES_BY_DATE_SQL = """
+    SELECT currency, value, multiplier, rate_date, fetched_at, created_at, updated_at
+    FROM fx_rates
+    WHERE rate_date = ?
+    ORDER BY currency
+"""
+
+_RATES_BY_CURRENCY_FROM_SQL = """
+    SELECT currency, value, multiplier, rate_date, fetched_at, created_at, updated_at
+    FROM fx_rates
+    WHERE currency = ? AND rate_date >= ?
+    ORDER BY rate_date DESC
+"""
+
+_RATES_BY_CURRENCY_SQL = """
+    SELECT currency, value, multiplier, rate_date, fetched_at, created_at, updated_at
+    FROM fx_rates
+    WHERE currency = ?
+    ORDER BY rate_date DESC
+    LIMIT 30
+"""
+
+_MAX_DATE_SQL = "SELECT MAX(rate_date) AS max_date FROM fx_rates"
 
 
 async def get_rates_by_date(env, date_str: str) -> list:
     """Get all rates for a specific date."""
     db = env.DB
-    result = await db.prepare("""
-        SELECT currency, value, multiplier, rate_date, fetched_at, created_at, updated_at
-        FROM fx_rates
-        WHERE rate_date = ?
-        ORDER BY currency
-    """).bind(date_str).all()
-    return result.results if result.results else []
+    result = await _prepare_cached(db, _RATES_BY_DATE_SQL).bind(date_str).all()
+    # Hand the driver's row array straight to the caller; wrapping it in
+    # a fresh list would just copy ~40 row objects per request.
+    return result.results or []
 
 
 async def get_rates_by_currency(env, currency: str, from_date: str = None) -> list:
@@ -81,119 +221,197 @@ async def get_rates_by_currency(env, currency: str, from_date: str = None) -> li
     db = env.DB
 
     if from_date:
-        result = await db.prepare("""
-            SELECT currency, value, multiplier, rate_date, fetched_at, created_at, updated_at
-            FROM fx_rates
-            WHERE currency = ? AND rate_date >= ?
-            ORDER BY rate_date DESC
-        """).bind(currency.upper(), from_date).all()
+        result = await _prepare_cached(db, _RATES_BY_CURRENCY_FROM_SQL).bind(
+            currency.upper(), from_date).all()
     else:
-        result = await db.prepare("""
-            SELECT currency, value, multiplier, rate_date, fetched_at, created_at, updated_at
-            FROM fx_rates
-            WHERE currency = ?
-            ORDER BY rate_date DESC
-            LIMIT 30
-        """).bind(currency.upper()).all()
+        result = await _prepare_cached(db, _RATES_BY_CURRENCY_SQL).bind(
+            currency.upper()).all()
+
+    return result.results or []
+
 
-    return result.results if result.results else []
+# Per-isolate memo for the latest-rates query, keyed by MAX(rate_date).
+# Rates change once a day, so between ingests every "latest" request can
+# be answered after a single cheap indexed MAX() probe.
+_latest_cache = {"date": None, "rows": None}
 
 
 async def get_latest_rates(env) -> list:
     """Get the most recent rates available."""
     db = env.DB
-    result = await db.prepare("""
-        SELECT currency, value, multiplier, rate_date, fetched_at, created_at, updated_at
-        FROM fx_rates
-        WHERE rate_date = (SELECT MAX(rate_date) FROM fx_rates)
-        ORDER BY currency
-    """).all()
-    return result.results if result.results else []
 
+    max_row = await _prepare_cached(db, _MAX_DATE_SQL).first()
+    max_date = max_row["max_date"] if max_row else None
+    if max_date is None:
+        return []
+
+    if _latest_cache["date"] == max_date:
+        return _latest_cache["rows"]
+
+    # We already know the latest date, so filter on it directly instead
+    # of re-deriving it with a MAX() subquery inside the row query.
+    rows = await get_rates_by_date(env, max_date)
+
+    _latest_cache["date"] = max_date
+    _latest_cache["rows"] = rows
+    return rows
+
+
+# Shared response headers, built once at import time
+_JSON_HEADERS = {
+    "Content-Type": "application/json",
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET, OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type, X-RapidAPI-Key"
+}
+
+# Compact serialization: no pretty-printing, no spaces after separators
+_JSON_SEPARATORS = (",", ":")
 
-def json_response(data: dict, status: int = 200) -> Response:
+# Prefer a C/Rust JSON encoder when the runtime ships one; fall back to
+# the stdlib. All three emit the same compact output.
+try:
+    import orjson
+
+    def _dumps(data) -> str:
+        return orjson.dumps(data).decode("utf-8")
+except ImportError:
+    try:
+        import ujson
+
+        def _dumps(data) -> str:
+            return ujson.dumps(data)
+    except ImportError:
+        def _dumps(data) -> str:
+            return json.dumps(data, separators=_JSON_SEPARATORS)
+
+# Static payloads serialized once at import time. Response objects are
+# single-use in Workers, so we hoist the body strings and construct a
+# fresh Response around them per request.
+_PREFLIGHT_BODY = _dumps({"status": "ok"})
+_HEALTH_BODY = _dumps({
+    "status": "healthy",
+    "service": "BNR FX Rates API",
+    "version": "1.0.0"
+})
+
+
+# Read endpoints are safe to cache briefly at the edge and client:
+# rates change once a day, so a short TTL absorbs request bursts
+# without risking a stale day. Errors and preflights stay uncached.
+_CACHE_CONTROL = "public, max-age=300"
+_CACHED_JSON_HEADERS = dict(_JSON_HEADERS, **{"Cache-Control": _CACHE_CONTROL})
+
+
+def json_response(data: dict, status: int = 200, cacheable: bool = False) -> Response:
     """Create JSON response with proper headers."""
     return Response(
-        json.dumps(data, indent=2),
+        _dumps(data),
         status=status,
-        headers={
-            "Content-Type": "application/json",
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "GET, OPTIONS",
-            "Access-Control-Allow-Headers": "Content-Type, X-RapidAPI-Key"
-        }
+        headers=_CACHED_JSON_HEADERS if cacheable else _JSON_HEADERS
     )
 
 
+def static_json_response(body: str, cacheable: bool = False) -> Response:
+    """Create a 200 JSON response from a pre-serialized body."""
+    return Response(body, status=200,
+                    headers=_CACHED_JSON_HEADERS if cacheable else _JSON_HEADERS)
+
+
+def is_valid_date(date_str: str) -> bool:
+    """Cheap shape check for YYYY-MM-DD (no regex, no datetime parse)."""
+    return (
+        len(date_str) == 10
+        and date_str[4] == "-"
+        and date_str[7] == "-"
+        and (date_str[:4] + date_str[5:7] + date_str[8:]).isdigit()
+    )
+
+
+def is_valid_currency(code: str) -> bool:
+    """Cheap shape check for a 3-letter ISO 4217 currency code."""
+    return len(code) == 3 and code.isalpha()
+
+
+async def handle_health(env, params) -> Response:
+    """Health check endpoint."""
+    return static_json_response(_HEALTH_BODY, cacheable=True)
+
+
+async def handle_rates(env, params) -> Response:
+    """Main rates endpoint."""
+    try:
+        # Query by specific date
+        if "date" in params:
+            if not is_valid_date(params["date"]):
+                return json_response({"error": "Invalid date, expected YYYY-MM-DD"}, 400)
+            rates = await get_rates_by_date(env, params["date"])
+            if not rates:
+                return json_response({"error": "No rates found for this date"}, 404)
+            return json_response({
+                "date": params["date"],
+                "base": "RON",
+                "rates": rates
+            }, cacheable=True)
+
+        # Query by currency with optional from date
+        elif "currency" in params:
+            if not is_valid_currency(params["currency"]):
+                return json_response({"error": "Invalid currency code"}, 400)
+            from_date = params.get("from")
+            if from_date is not None and not is_valid_date(from_date):
+                return json_response({"error": "Invalid from date, expected YYYY-MM-DD"}, 400)
+            rates = await get_rates_by_currency(env, params["currency"], from_date)
+            if not rates:
+                return json_response({"error": "No rates found for this currency"}, 404)
+            return json_response({
+                "currency": params["currency"].upper(),
+                "base": "RON",
+                "history": rates
+            }, cacheable=True)
+
+        # Default: return latest rates
+        else:
+            rates = await get_latest_rates(env)
+            if not rates:
+                return json_response({"error": "No rates available"}, 404)
+            return json_response({
+                "date": rates[0]["rate_date"] if rates else None,
+                "base": "RON",
+                "rates": rates
+            }, cacheable=True)
+
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
+
+
+# Path -> handler dispatch table; lookup is O(1) regardless of how many
+# endpoints get added.
+_ROUTES = {
+    "": handle_health,
+    "health": handle_health,
+    "rates": handle_rates,
+}
+
+
 @handler
 async def on_fetch(request: Request, env, ctx) -> Response:
     """Handle HTTP requests - API endpoints."""
-    url = request.url
-    path = url.split("?")[0].rstrip("/").split("/")[-1] if "?" in url else url.rstrip("/").split("/")[-1]
-
-    # Parse query parameters
-    params = {}
-    if "?" in url:
-        query_string = url.split("?")[1]
-        for param in query_string.split("&"):
-            if "=" in param:
-                key, value = param.split("=", 1)
-                params[key] = value
+    parts = urlsplit(request.url)
+    path = parts.path.rstrip("/").rsplit("/", 1)[-1]
+
+    # Parse query parameters (parse_qs handles percent-decoding for us)
+    params = {key: values[0] for key, values in parse_qs(parts.query).items()}
 
     # Handle CORS preflight
     if request.method == "OPTIONS":
-        return json_response({"status": "ok"})
-
-    # Health check endpoint
-    if path == "health" or path == "":
-        return json_response({
-            "status": "healthy",
-            "service": "BNR FX Rates API",
-            "version": "1.0.0"
-        })
-
-    # Main rates endpoint
-    if path == "rates":
-        try:
-            # Query by specific date
-            if "date" in params:
-                rates = await get_rates_by_date(env, params["date"])
-                if not rates:
-                    return json_response({"error": "No rates found for this date"}, 404)
-                return json_response({
-                    "date": params["date"],
-                    "base": "RON",
-                    "rates": rates
-                })
-
-            # Query by currency with optional from date
-            elif "currency" in params:
-                from_date = params.get("from")
-                rates = await get_rates_by_currency(env, params["currency"], from_date)
-                if not rates:
-                    return json_response({"error": "No rates found for this currency"}, 404)
-                return json_response({
-                    "currency": params["currency"].upper(),
-                    "base": "RON",
-                    "history": rates
-                })
-
-            # Default: return latest rates
-            else:
-                rates = await get_latest_rates(env)
-                if not rates:
-                    return json_response({"error": "No rates available"}, 404)
-                return json_response({
-                    "date": rates[0]["rate_date"] if rates else None,
-                    "base": "RON",
-                    "rates": rates
-                })
-
-        except Exception as e:
-            return json_response({"error": str(e)}, 500)
-
-    # 404 for unknown paths
-    return json_response({"error": "Not found"}, 404)
+        return static_json_response(_PREFLIGHT_BODY)
+
+    route = _ROUTES.get(path)
+    if route is None:
+        # 404 for unknown paths
+        return json_response({"error": "Not found"}, 404)
+    return await route(env, params)
 
 
 @handler
@@ -5,6 +5,8 @@ Unit tests for BNR FX Rates Worker
 import pytest
 import re
 
+from src.worker import parse_bnr_xml, is_valid_currency, is_valid_date
+
 
 # Test XML parsing logic
 class TestXMLParsing:
@@ -37,80 +39,62 @@ class TestXMLParsing:
         </Body>
     </DataSet>"""
 
-    def parse_bnr_xml(self, xml_text: str) -> dict:
-        """
-        Parse BNR XML format and extract rates.
-        This is a copy of the worker's parsing logic for testing.
-        """
-        rates = []
-        date_str = None
-
-        # Extract date from <Cube date="YYYY-MM-DD">
-        date_match = re.search(r'<Cube date="(\d{4}-\d{2}-\d{2})"', xml_text)
-        if date_match:
-            date_str = date_match.group(1)
-
-        # Extract rates
-        rate_pattern = re.compile(
-            r'<Rate currency="([A-Z]{3})"(?:\s+multiplier="(\d+)")?>([0-9.]+)</Rate>'
-        )
-        for match in rate_pattern.finditer(xml_text):
-            currency = match.group(1)
-            multiplier = int(match.group(2)) if match.group(2) else 1
-            value = float(match.group(3))
-            rates.append({
-                "currency": currency,
-                "value": value,
-                "multiplier": multiplier
-            })
-
-        return {"date": date_str, "rates": rates}
-
     def test_parse_date(self):
         """Test that date is correctly extracted from XML."""
-        result = self.parse_bnr_xml(self.SAMPLE_BNR_XML)
+        result = parse_bnr_xml(self.SAMPLE_BNR_XML)
         assert result["date"] == "2025-01-15"
 
     def test_parse_rates_count(self):
         """Test that all rates are extracted."""
-        result = self.parse_bnr_xml(self.SAMPLE_BNR_XML)
+        result = parse_bnr_xml(self.SAMPLE_BNR_XML)
         assert len(result["rates"]) == 10
 
     def test_parse_eur_rate(self):
         """Test EUR rate extraction."""
-        result = self.parse_bnr_xml(self.SAMPLE_BNR_XML)
-        eur_rate = next((r for r in result["rates"] if r["currency"] == "EUR"), None)
-        assert eur_rate is not None
-        assert eur_rate["value"] == 4.9770
-        assert eur_rate["multiplier"] == 1
+        result = parse_bnr_xml(self.SAMPLE_BNR_XML)
+        eur_rate = next((r for r in result["rates"] if r[0] == "EUR"), None)
+        assert eur_rate == ("EUR", 4.9770, 1)
 
     def test_parse_multiplier(self):
         """Test rate with multiplier (HUF has multiplier=100)."""
-        result = self.parse_bnr_xml(self.SAMPLE_BNR_XML)
-        huf_rate = next((r for r in result["rates"] if r["currency"] == "HUF"), None)
-        assert huf_rate is not None
-        assert huf_rate["multiplier"] == 100
-        assert huf_rate["value"] == 1.1876
+        result = parse_bnr_xml(self.SAMPLE_BNR_XML)
+        huf_rate = next((r for r in result["rates"] if r[0] == "HUF"), None)
+        assert huf_rate == ("HUF", 1.1876, 100)
 
     def test_parse_usd_rate(self):
         """Test USD rate extraction."""
-        result = self.parse_bnr_xml(self.SAMPLE_BNR_XML)
-        usd_rate = next((r for r in result["rates"] if r["currency"] == "USD"), None)
+        result = parse_bnr_xml(self.SAMPLE_BNR_XML)
+        usd_rate = next((r for r in result["rates"] if r[0] == "USD"), None)
         assert usd_rate is not None
-        assert usd_rate["value"] == 4.5623
+        assert usd_rate[1] == 4.5623
 
     def test_empty_xml(self):
         """Test handling of empty/invalid XML."""
-        result = self.parse_bnr_xml("")
+        result = parse_bnr_xml("")
         assert result["date"] is None
         assert result["rates"] == []
 
     def test_malformed_xml(self):
         """Test handling of malformed XML."""
-        result = self.parse_bnr_xml("<invalid>not valid bnr xml</invalid>")
+        result = parse_bnr_xml("<invalid>not valid bnr xml</invalid>")
         assert result["date"] is None
         assert result["rates"] == []
 
+    def test_prefixed_namespace(self):
+        """Test a document using an explicit namespace prefix."""
+        xml = """<?xml version="1.0" encoding="utf-8"?>
+        <d:DataSet xmlns:d="http://www.bnr.ro/xsd">
+            <d:Body>
+                <d:Cube date="2025-01-15">
+                    <d:Rate currency="EUR">4.9770</d:Rate>
+                    <d:Rate currency="HUF" multiplier="100">1.1876</d:Rate>
+                </d:Cube>
+            </d:Body>
+        </d:DataSet>"""
+        result = parse_bnr_xml(xml)
+        assert result["date"] == "2025-01-15"
+        assert result["rates"] == [("EUR", 4.9770, 1), ("HUF", 1.1876, 100)]
+
 
 class TestAPIResponses:
     """Test API response format validation."""
@@ -164,6 +148,22 @@ class TestQueryParameters:
         for currency in valid_currencies:
             assert re.match(pattern, currency)
 
+    def test_date_validation(self):
+        """Test the worker's cheap date validator."""
+        assert is_valid_date("2025-01-15")
+        assert not is_valid_date("2025-1-15")
+        assert not is_valid_date("15-01-2025")
+        assert not is_valid_date("2025-01-15; DROP TABLE fx_rates")
+        assert not is_valid_date("")
+
+    def test_currency_validation(self):
+        """Test the worker's cheap currency validator."""
+        assert is_valid_currency("EUR")
+        assert is_valid_currency("eur")
+        assert not is_valid_currency("EURO")
+        assert not is_valid_currency("E1R")
+        assert not is_valid_currency("")
+
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])